@@ -11,160 +11,484 @@ Generates:
 NAR format: https://nixos.org/manual/nix/stable/protocols/nix-archive
 """
 
+import argparse
+import functools
 import hashlib
 import json
+import mmap
+import operator
 import os
+import re
+import stat
 import struct
-import subprocess
 import sys
-import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import zstandard
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 
 # ─── Nixbase32 Encoding ────────────────────────────────────────────────────
 
 NIX_CHARS = "0123456789abcdfghijklmnpqrsvwxyz"
+_NIX_BYTES = NIX_CHARS.encode()
 
 def nixbase32_encode(data: bytes) -> str:
     """Encode bytes to nixbase32 (Nix's custom base32 alphabet).
 
     Nix processes bytes in reverse order and packs 5 bits per character.
-    For 32 bytes (SHA-256), produces 52 characters.
+    For 32 bytes (SHA-256), produces 52 characters. Reading the input as
+    one little-endian integer turns each character into a single mask
+    and shift, written straight into a preallocated ASCII buffer.
     """
     n_chars = (len(data) * 8 + 4) // 5
-    result = []
+    n = int.from_bytes(data, "little")
+    out = bytearray(n_chars)
     for i in range(n_chars - 1, -1, -1):
-        bit_offset = i * 5
-        byte_idx = bit_offset // 8
-        bit_idx = bit_offset % 8
-        val = (data[byte_idx] >> bit_idx) & 0x1F
-        if bit_idx > 3 and byte_idx + 1 < len(data):
-            val |= (data[byte_idx + 1] << (8 - bit_idx)) & 0x1F
-        result.append(NIX_CHARS[val])
-    return "".join(result)
+        out[i] = _NIX_BYTES[n & 0x1F]
+        n >>= 5
+    return out.decode("ascii")
 
 
 # ─── NAR Serializer ────────────────────────────────────────────────────────
 
-def _write_str(f, s):
-    """Write a NAR string: 8-byte LE length + content + padding to 8 bytes."""
-    b = s.encode("utf-8") if isinstance(s, str) else s
-    f.write(struct.pack("<Q", len(b)))
-    f.write(b)
-    pad = (8 - (len(b) % 8)) % 8
-    if pad:
-        f.write(b"\x00" * pad)
+# File contents are streamed in chunks this large; bigger chunks mean
+# fewer Python-level write/hash calls per byte.
+READ_CHUNK_SIZE = 1024 * 1024
+
+# Precompiled length-prefix packer and the eight possible padding runs,
+# so the per-token work stays inside C calls.
+_pack_u64 = struct.Struct("<Q").pack
+_NAR_PADDING = tuple(b"\x00" * n for n in range(8))
+
+
+def _pack_str(b):
+    """Encode a NAR string: 8-byte LE length + content + padding to 8 bytes.
+
+    Only needed for variable data (names, symlink targets); fixed tokens
+    are the NAR_* constants below.
+    """
+    return _pack_u64(len(b)) + b + _NAR_PADDING[-len(b) % 8]
+
+
+# Files up to this size are handed to the writer as one mmap instead of
+# being read in chunks.
+MMAP_MAX_SIZE = 256 * 1024 * 1024
+
+
+def _write_file_contents(f, fh, size):
+    """Copy the `size` bytes of the open file `fh` to `f`."""
+    if size <= MMAP_MAX_SIZE:
+        # One zero-copy buffer: hashing and compression each consume it
+        # in a single C-level call.
+        with mmap.mmap(fh.fileno(), size, access=mmap.ACCESS_READ) as mm:
+            f.write(mm)
+        return
+
+    # Read straight into one reused buffer rather than allocating a
+    # fresh bytes object per chunk.
+    chunk = bytearray(READ_CHUNK_SIZE)
+    view = memoryview(chunk)
+    while True:
+        n = fh.readinto(chunk)
+        if not n:
+            break
+        f.write(view[:n])
+
+
+# Every fixed NAR token, encoded once at import.
+NAR_MAGIC = _pack_str(b"nix-archive-1")
+NAR_LPAREN = _pack_str(b"(")
+NAR_RPAREN = _pack_str(b")")
+NAR_TYPE = _pack_str(b"type")
+NAR_REGULAR = _pack_str(b"regular")
+NAR_DIRECTORY = _pack_str(b"directory")
+NAR_SYMLINK = _pack_str(b"symlink")
+NAR_TARGET = _pack_str(b"target")
+NAR_EXECUTABLE = _pack_str(b"executable")
+NAR_EMPTY = _pack_str(b"")
+NAR_CONTENTS = _pack_str(b"contents")
+NAR_ENTRY = _pack_str(b"entry")
+NAR_NAME = _pack_str(b"name")
+NAR_NODE = _pack_str(b"node")
+
+_entry_name = operator.attrgetter("name")
 
 
 def _serialize_entry(f, path):
-    """Recursively serialize one filesystem entry to NAR."""
-    _write_str(f, "(")
-    _write_str(f, "type")
-
-    if os.path.islink(path):
-        _write_str(f, "symlink")
-        _write_str(f, "target")
-        target = os.readlink(path)
-        _write_str(f, target if isinstance(target, bytes) else target.encode("utf-8"))
-
-    elif os.path.isdir(path):
-        _write_str(f, "directory")
-        for name in sorted(os.listdir(path)):
-            _write_str(f, "entry")
-            _write_str(f, "(")
-            _write_str(f, "name")
-            _write_str(f, name)
-            _write_str(f, "node")
-            _serialize_entry(f, os.path.join(path, name))
-            _write_str(f, ")")
-
-    elif os.path.isfile(path):
-        _write_str(f, "regular")
-        if os.access(path, os.X_OK):
-            _write_str(f, "executable")
-            _write_str(f, "")
-        _write_str(f, "contents")
-        size = os.path.getsize(path)
-        f.write(struct.pack("<Q", size))
-        with open(path, "rb") as fh:
-            while True:
-                chunk = fh.read(65536)
-                if not chunk:
-                    break
-                f.write(chunk)
-        pad = (8 - (size % 8)) % 8
-        if pad:
-            f.write(b"\x00" * pad)
-    else:
-        raise ValueError(f"Unsupported file type: {path}")
+    """Serialize a filesystem tree to NAR.
 
-    _write_str(f, ")")
+    Walks iteratively with os.scandir: entry types come from the
+    directory listing, and only regular files need a stat (for size and
+    mode). The stack holds pending nodes as (path, DirEntry or None) and
+    the closing tokens to emit once a directory's children are done.
 
+    The walk uses bytes paths, so names come back as raw bytes: they sort
+    in the byte order Nix uses and need no re-encoding, and non-UTF-8
+    names serialize correctly.
 
-def serialize_to_nar(store_path, output_path):
-    """Serialize a store path to a NAR file. Returns (nar_hash_bytes, nar_size)."""
-    hasher = hashlib.sha256()
-    size = 0
+    NAR tokens are collected in a buffer and written out in one call
+    before each file's contents (and at the end), instead of one write
+    per token.
+    """
+    buf = bytearray()
+    stack = [(os.fsencode(path), None)]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, bytes):
+            buf += item
+            continue
 
-    with open(output_path, "wb") as f:
-        class HashingWriter:
-            def write(self, data):
-                nonlocal size
-                hasher.update(data)
-                size += len(data)
-                f.write(data)
+        path, entry = item
+        if entry is None:
+            st = os.lstat(path)
+            is_link = stat.S_ISLNK(st.st_mode)
+            is_dir = stat.S_ISDIR(st.st_mode)
+            is_file = stat.S_ISREG(st.st_mode)
+        else:
+            buf += NAR_ENTRY
+            buf += NAR_LPAREN
+            buf += NAR_NAME
+            buf += _pack_str(entry.name)
+            buf += NAR_NODE
+            is_link = entry.is_symlink()
+            is_dir = entry.is_dir(follow_symlinks=False)
+            is_file = entry.is_file(follow_symlinks=False)
+
+        buf += NAR_LPAREN
+        buf += NAR_TYPE
+
+        if is_link:
+            buf += NAR_SYMLINK
+            buf += NAR_TARGET
+            buf += _pack_str(os.readlink(path))
+
+        elif is_dir:
+            buf += NAR_DIRECTORY
+            if entry is not None:
+                stack.append(NAR_RPAREN)
+            stack.append(NAR_RPAREN)
+            with os.scandir(path) as it:
+                children = sorted(it, key=_entry_name)
+            for child in reversed(children):
+                stack.append((child.path, child))
+            continue
 
-        hw = HashingWriter()
-        _write_str(hw, "nix-archive-1")
-        _serialize_entry(hw, store_path)
+        elif is_file:
+            if entry is not None:
+                st = entry.stat(follow_symlinks=False)
+            size = st.st_size
+            buf += NAR_REGULAR
+            if st.st_mode & stat.S_IXUSR:
+                buf += NAR_EXECUTABLE
+                buf += NAR_EMPTY
+            buf += NAR_CONTENTS
+            buf += _pack_u64(size)
+            if size:
+                f.write(buf)
+                buf = bytearray()
+                with open(path, "rb", buffering=0) as fh:
+                    _write_file_contents(f, fh, size)
+            buf += _NAR_PADDING[-size % 8]
+        else:
+            raise ValueError(f"Unsupported file type: {os.fsdecode(path)}")
+
+        buf += NAR_RPAREN
+        if entry is not None:
+            buf += NAR_RPAREN
+
+        # Keep the buffer bounded for huge directories of tiny entries.
+        if len(buf) >= READ_CHUNK_SIZE:
+            f.write(buf)
+            buf = bytearray()
+
+    if buf:
+        f.write(buf)
+
+
+class HashingWriter:
+    """File-like wrapper that hashes and counts every byte on its way to `f`."""
+
+    def __init__(self, f):
+        self.f = f
+        # hashlib's OpenSSL backend already dispatches to SHA-NI / ARMv8
+        # SHA2 instructions when the CPU has them.
+        self.hasher = hashlib.sha256(usedforsecurity=False)
+        self.size = 0
+
+    def write(self, data):
+        self.hasher.update(data)
+        self.size += len(data)
+        return self.f.write(data)
+
+
+# A store path reference: the store directory followed by a nixbase32
+# hash (the alphabet omits e, o, t and u) and the dash before the name.
+_STORE_REF_RE = re.compile(rb"/nix/store/([0-9a-df-np-sv-z]{32})-")
+_STORE_REF_LEN = len(b"/nix/store/") + 32 + 1
+
+
+class ReferenceScanningWriter(HashingWriter):
+    """HashingWriter that also collects the store path hashes it sees.
+
+    Scans each chunk while it is already cache-hot for hashing, rather
+    than making a separate pass over the NAR. The last few bytes of each
+    chunk are kept so references split across two writes are found too.
+    """
 
-    return hasher.digest(), size
+    def __init__(self, f):
+        super().__init__(f)
+        self.references = set()
+        self._tail = b""
 
+    def write(self, data):
+        keep = _STORE_REF_LEN - 1
+        if self._tail:
+            seam = self._tail + bytes(data[:keep])
+            self.references.update(_STORE_REF_RE.findall(seam))
+        else:
+            seam = b""
+        self.references.update(_STORE_REF_RE.findall(data))
+        if len(data) >= keep:
+            self._tail = bytes(data[-keep:])
+        else:
+            self._tail = (seam or bytes(data))[-keep:]
+        return super().write(data)
 
-# ─── Binary Cache Builder ──────────────────────────────────────────────────
 
-def store_path_hash(path):
-    """Extract the nixbase32 hash from a store path.
-    /nix/store/{hash}-{name} → {hash} (32 chars)
+def serialize_to_nar(store_path, f):
+    """Serialize a store path as a NAR stream into the writable `f`."""
+    f.write(NAR_MAGIC)
+    _serialize_entry(f, store_path)
+
+
+# Rough NAR framing cost of one filesystem entry (type/name/node tokens).
+NAR_ENTRY_OVERHEAD = 200
+
+
+def _estimate_nar_size(store_path):
+    """Cheaply estimate a store path's NAR size from file sizes.
+
+    Counts file contents padded to 8 bytes plus a fixed per-entry
+    allowance for NAR framing. Only used for sizing decisions, never
+    written anywhere.
     """
-    basename = os.path.basename(path)
-    return basename[:32]
+    if os.path.islink(store_path) or not os.path.isdir(store_path):
+        return os.lstat(store_path).st_size + NAR_ENTRY_OVERHEAD
+
+    total = NAR_ENTRY_OVERHEAD
+    for root, dirs, files in os.walk(store_path):
+        total += NAR_ENTRY_OVERHEAD * (len(dirs) + len(files))
+        for name in files:
+            size = os.lstat(os.path.join(root, name)).st_size
+            total += (size + 7) & ~7
+    return total
+
+
+def write_compressed_nar(store_path, compressed_path, cctx):
+    """NAR-serialize, hash and zstd-compress a store path in a single pass.
+
+    NAR bytes are hashed on their way into the compressor, and the
+    compressed bytes are hashed on their way to disk, so nothing is
+    re-read. Returns (nar_hash_bytes, nar_size, file_hash_bytes,
+    file_size, referenced_hashes), the last being the set of store path
+    hashes (as bytes) that occur in the NAR.
+    """
+    with open(compressed_path, "wb") as out_f:
+        file_writer = HashingWriter(out_f)
+        with cctx.stream_writer(file_writer, closefd=False) as compressor:
+            nar_writer = ReferenceScanningWriter(compressor)
+            serialize_to_nar(store_path, nar_writer)
+
+    return (
+        nar_writer.hasher.digest(),
+        nar_writer.size,
+        file_writer.hasher.digest(),
+        file_writer.size,
+        nar_writer.references,
+    )
+
+
+# ─── Binary Cache Builder ──────────────────────────────────────────────────
 
+# zstd levels: 15 gets most of the ratio of the archival levels at a
+# fraction of the CPU. With --archival, large NARs are worth level 22
+# (which needs a 128 MiB decompression window).
+DEFAULT_ZSTD_LEVEL = 15
+ARCHIVAL_ZSTD_LEVEL = 22
+ARCHIVAL_THRESHOLD = 100 * 1024 * 1024
 
-def store_path_name(path):
-    """Extract the name from a store path.
-    /nix/store/{hash}-{name} → {name}
+# NARs estimated below this size are compressed synchronously: zstd
+# worker threads only pay off once a stream spans several of their jobs.
+MT_COMPRESSION_THRESHOLD = 32 * 1024 * 1024
+
+
+def split_store_path(path):
+    """Split a store path into its hash and name.
+    /nix/store/{hash}-{name} → ({hash}, {name})
+
+    Store paths never end in a slash, so the basename is just the text
+    after the last one.
     """
-    basename = os.path.basename(path)
-    return basename[33:]  # skip hash + dash
+    basename = path.rsplit("/", 1)[-1]
+    return basename[:32], basename[33:]  # skip hash + dash
 
 
-def build_narinfo(store_path, nar_hash_bytes, nar_size, file_hash_bytes, file_size, nar_url):
-    """Generate a narinfo file content.
+_NARINFO_TEMPLATE = (
+    b"StorePath: %s\n"
+    b"URL: %s\n"
+    b"Compression: zstd\n"
+    b"FileHash: sha256:%s\n"
+    b"FileSize: %d\n"
+    b"NarHash: sha256:%s\n"
+    b"NarSize: %d\n"
+    b"References: %s\n"
+)
+
+
+def build_narinfo(
+    store_path, nar_hash_bytes, nar_size, file_hash_bytes, file_size, nar_url,
+    references=(),
+):
+    """Generate a narinfo file content as bytes.
 
     Uses nixbase32 for hashes (the canonical format for Nix binary caches).
+    `references` are store path basenames ({hash}-{name}).
+    """
+    return _NARINFO_TEMPLATE % (
+        store_path.encode(),
+        nar_url.encode(),
+        nixbase32_encode(file_hash_bytes).encode(),
+        file_size,
+        nixbase32_encode(nar_hash_bytes).encode(),
+        nar_size,
+        " ".join(references).encode(),
+    )
+
+
+# Per-process compressors, set up by _init_worker().
+_cctx_small = None
+_cctx_large = None
+_cctx_archival = None
+_known_paths = {}
+
+
+def _init_worker(level, archival, zstd_threads, known_paths):
+    """Create this process's zstd compressors.
+
+    Compressors cannot be pickled, so each worker builds its own once.
+    Small NARs are compressed synchronously. Large NARs get
+    `zstd_threads` zstd worker threads, so compression runs in C
+    alongside the Python thread that reads and hashes the next input:
+    one per pool worker, or the whole job budget when packages are
+    processed one at a time.
+    With `archival`, the very largest NARs use the archival level.
+
+    `known_paths` maps the hash of every store path in the cache to its
+    basename, for resolving references found in NARs.
     """
-    nar_hash_nix32 = nixbase32_encode(nar_hash_bytes)
-    file_hash_nix32 = nixbase32_encode(file_hash_bytes)
-    lines = [
-        f"StorePath: {store_path}",
-        f"URL: {nar_url}",
-        f"Compression: zstd",
-        f"FileHash: sha256:{file_hash_nix32}",
-        f"FileSize: {file_size}",
-        f"NarHash: sha256:{nar_hash_nix32}",
-        f"NarSize: {nar_size}",
-        f"References: ",
-    ]
-    return "\n".join(lines) + "\n"
+    global _cctx_small, _cctx_large, _cctx_archival, _known_paths
+    _cctx_small = zstandard.ZstdCompressor(level=level)
+    _cctx_large = zstandard.ZstdCompressor(level=level, threads=zstd_threads)
+    _cctx_archival = None
+    if archival:
+        _cctx_archival = zstandard.ZstdCompressor(
+            level=ARCHIVAL_ZSTD_LEVEL, threads=zstd_threads
+        )
+    _known_paths = known_paths
+
+
+def process_package(store_path, out_dir):
+    """Write the compressed NAR and narinfo for one store path.
+
+    Returns the NAR fields of its packages.json entries. Store paths only
+    ever write files named after their own hashes, so any number can run
+    concurrently.
+    """
+    sp_hash, _ = split_store_path(store_path)
+
+    # 1. Serialize, compress and hash in one streaming pass. The output
+    #    is named after the NAR hash, which is only known once the stream
+    #    is finished, so write under a temporary name first and rename.
+    partial_path = os.path.join(out_dir, "nar", f"{sp_hash}.nar.zst.tmp")
+    estimated_size = _estimate_nar_size(store_path)
+    if _cctx_archival is not None and estimated_size >= ARCHIVAL_THRESHOLD:
+        cctx = _cctx_archival
+    elif estimated_size >= MT_COMPRESSION_THRESHOLD:
+        cctx = _cctx_large
+    else:
+        cctx = _cctx_small
+    try:
+        nar_hash_bytes, nar_size, file_hash_bytes, file_size, ref_hashes = (
+            write_compressed_nar(store_path, partial_path, cctx)
+        )
+        nar_hash_hex = nar_hash_bytes.hex()
+
+        compressed_name = f"{nar_hash_hex}.nar.zst"
+        os.replace(partial_path, os.path.join(out_dir, "nar", compressed_name))
+    finally:
+        # Never leave a partial NAR behind: the merge scripts copy
+        # everything in nar/.
+        if os.path.exists(partial_path):
+            os.unlink(partial_path)
+
+    # 2. Write narinfo
+    nar_url = f"nar/{compressed_name}"
+    # Only paths that are in this cache can be listed: clients fetch the
+    # narinfo of every reference. Nix includes self-references too.
+    references = sorted(
+        _known_paths[h] for h in (r.decode() for r in ref_hashes) if h in _known_paths
+    )
+    narinfo_content = build_narinfo(
+        store_path, nar_hash_bytes, nar_size, file_hash_bytes, file_size, nar_url,
+        references,
+    )
+    narinfo_path = os.path.join(out_dir, f"{sp_hash}.narinfo")
+    with open(narinfo_path, "wb") as nf:
+        nf.write(narinfo_content)
+
+    return {
+        "narHash": f"sha256:{nar_hash_hex}",
+        "narSize": nar_size,
+        "fileSize": file_size,
+    }
+
+
+def _available_cpus():
+    """Number of CPUs this process may run on (respects taskset/cgroups)."""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
 
 
 def main():
-    if len(sys.argv) != 3:
-        print(f"Usage: {sys.argv[0]} <package-info.json> <output-dir>", file=sys.stderr)
-        sys.exit(1)
-
-    info_path = sys.argv[1]
-    out_dir = sys.argv[2]
+    parser = argparse.ArgumentParser(
+        description="Build a Nix-compatible binary cache from cross-compiled packages"
+    )
+    parser.add_argument("package_info", help="JSON list of {name, storePath, pname, version}")
+    parser.add_argument("out_dir", help="Output directory for the cache")
+    parser.add_argument(
+        "--compression-level", type=int, default=DEFAULT_ZSTD_LEVEL,
+        help=f"zstd compression level (default: {DEFAULT_ZSTD_LEVEL})",
+    )
+    parser.add_argument(
+        "--archival", action="store_true",
+        help=f"Compress NARs over {ARCHIVAL_THRESHOLD // (1024 * 1024)} MiB at zstd level "
+             f"{ARCHIVAL_ZSTD_LEVEL} (slow; needs a 128 MiB window to decompress)",
+    )
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=0,
+        help="CPU budget: packages processed in parallel, or zstd threads when "
+             "there is only one (default, or 0: all CPUs this process may use)",
+    )
+    args = parser.parse_args()
+
+    info_path = args.package_info
+    out_dir = args.out_dir
 
     with open(info_path) as f:
         package_list = json.load(f)
@@ -176,82 +500,73 @@ def main():
     total_nar = 0
     total_compressed = 0
 
+    # Several names can point at one store path (aliases, meta-packages);
+    # each store path is serialized once and its NAR shared by all of them.
+    entries_by_path = {}
     for entry in package_list:
-        name = entry["name"]
-        store_path = entry["storePath"]
-        pname = entry.get("pname", name)
-        version = entry.get("version", "unknown")
-
-        if not os.path.exists(store_path):
-            print(f"  SKIP {name}: {store_path} not found", file=sys.stderr)
+        if not os.path.exists(entry["storePath"]):
+            print(f"  SKIP {entry['name']}: {entry['storePath']} not found", file=sys.stderr)
             continue
-
-        sp_hash = store_path_hash(store_path)
-        print(f"  {name}: NAR-serializing {store_path}...", file=sys.stderr)
-
-        # 1. Serialize to NAR (temp file)
-        with tempfile.NamedTemporaryFile(suffix=".nar", delete=False) as tmp:
-            tmp_nar = tmp.name
-
-        try:
-            nar_hash_bytes, nar_size = serialize_to_nar(store_path, tmp_nar)
-            nar_hash_hex = nar_hash_bytes.hex()
+        entries_by_path.setdefault(entry["storePath"], []).append(entry)
+    store_paths = list(entries_by_path)
+
+    budget = args.jobs if args.jobs > 0 else _available_cpus()
+    jobs = max(1, min(budget, len(store_paths)))
+    known_paths = {}
+    for store_path in store_paths:
+        sp_hash, sp_name = split_store_path(store_path)
+        known_paths[sp_hash] = f"{sp_hash}-{sp_name}"
+    worker_args = (
+        args.compression_level, args.archival,
+        budget if jobs == 1 else 1, known_paths,
+    )
+    process = functools.partial(process_package, out_dir=out_dir)
+
+    if jobs == 1:
+        _init_worker(*worker_args)
+        results = map(process, store_paths)
+        executor = None
+    else:
+        executor = ProcessPoolExecutor(
+            max_workers=jobs, initializer=_init_worker, initargs=worker_args
+        )
+        results = executor.map(process, store_paths)
+
+    try:
+        for store_path, nar_fields in zip(store_paths, results):
+            names = []
+            for entry in entries_by_path[store_path]:
+                name = entry["name"]
+                names.append(name)
+                index["packages"][name] = {
+                    "storePath": store_path,
+                    "pname": entry.get("pname", name),
+                    "version": entry.get("version", "unknown"),
+                    **nar_fields,
+                }
+            nar_size = nar_fields["narSize"]
+            file_size = nar_fields["fileSize"]
             total_nar += nar_size
-
-            # 2. Compress with zstd
-            compressed_name = f"{nar_hash_hex}.nar.zst"
-            compressed_path = os.path.join(out_dir, "nar", compressed_name)
-
-            subprocess.run(
-                ["zstd", "-q", "-19", "--rm", tmp_nar, "-o", compressed_path],
-                check=True,
-            )
-
-            # 3. Hash the compressed file
-            file_hasher = hashlib.sha256()
-            file_size = 0
-            with open(compressed_path, "rb") as cf:
-                while True:
-                    chunk = cf.read(65536)
-                    if not chunk:
-                        break
-                    file_hasher.update(chunk)
-                    file_size += len(chunk)
-            file_hash_bytes = file_hasher.digest()
             total_compressed += file_size
 
-            # 4. Write narinfo
-            nar_url = f"nar/{compressed_name}"
-            narinfo_content = build_narinfo(
-                store_path, nar_hash_bytes, nar_size, file_hash_bytes, file_size, nar_url
-            )
-            narinfo_path = os.path.join(out_dir, f"{sp_hash}.narinfo")
-            with open(narinfo_path, "w") as nf:
-                nf.write(narinfo_content)
-
-            # 5. Add to index
-            index["packages"][name] = {
-                "storePath": store_path,
-                "pname": pname,
-                "version": version,
-                "narHash": f"sha256:{nar_hash_hex}",
-                "narSize": nar_size,
-                "fileSize": file_size,
-            }
-
             ratio = (file_size / nar_size * 100) if nar_size > 0 else 0
+            print(f"  {', '.join(names)}: {store_path}", file=sys.stderr)
             print(
                 f"         NAR {nar_size // 1024}K → zstd {file_size // 1024}K ({ratio:.0f}%)",
                 file=sys.stderr,
             )
-
-        finally:
-            if os.path.exists(tmp_nar):
-                os.unlink(tmp_nar)
+    finally:
+        if executor is not None:
+            executor.shutdown()
 
     # Write packages.json index
-    with open(os.path.join(out_dir, "packages.json"), "w") as f:
-        json.dump(index, f, indent=2, sort_keys=True)
+    index_path = os.path.join(out_dir, "packages.json")
+    if orjson is not None:
+        with open(index_path, "wb") as f:
+            f.write(orjson.dumps(index, option=orjson.OPT_SORT_KEYS | orjson.OPT_INDENT_2))
+    else:
+        with open(index_path, "w") as f:
+            json.dump(index, f, sort_keys=True, separators=(",", ":"))
 
     # Write nix-cache-info
     with open(os.path.join(out_dir, "nix-cache-info"), "w") as f:
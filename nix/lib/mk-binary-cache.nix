@@ -33,15 +33,19 @@ in
 hostPkgs.runCommand "redox-binary-cache"
   {
     nativeBuildInputs = [
-      hostPkgs.python3
-      hostPkgs.zstd
+      (hostPkgs.python3.withPackages (ps: [
+        ps.zstandard
+        ps.orjson
+      ]))
     ];
     passAsFile = [ "packageInfoJson" ];
     inherit packageInfoJson;
   }
   ''
     echo "Building binary cache for ${toString (builtins.length packageEntries)} packages..."
+    # Stay within the builder's core allowance (0 means all cores).
     python3 ${./build-binary-cache.py} \
+      -j "''${NIX_BUILD_CORES:-0}" \
       "$packageInfoJsonPath" \
       "$out"
   ''
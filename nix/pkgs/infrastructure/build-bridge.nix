@@ -27,7 +27,10 @@
 }:
 
 let
-  python = pkgs.python3;
+  python = pkgs.python3.withPackages (ps: [
+    ps.zstandard
+    ps.orjson
+  ]);
   nix = pkgs.nix;
   buildBinaryCachePy = ../../lib/build-binary-cache.py;
   bridgeEvalNix = ../../lib/bridge-eval.nix;
@@ -19,8 +19,10 @@
 }:
 
 let
-  python = pkgs.python3;
-  zstd = pkgs.zstd;
+  python = pkgs.python3.withPackages (ps: [
+    ps.zstandard
+    ps.orjson
+  ]);
   nix = pkgs.nix;
 
   # The NAR serializer / cache builder from the build system
@@ -322,7 +324,6 @@ pkgs.writeShellScriptBin "push-to-redox" ''
   export PATH="${
     lib.makeBinPath [
       python
-      zstd
       nix
     ]
   }:$PATH"
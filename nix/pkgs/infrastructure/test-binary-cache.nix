@@ -17,6 +17,10 @@
 
 let
   buildBinaryCachePy = ../../lib/build-binary-cache.py;
+  python = pkgs.python3.withPackages (ps: [
+    ps.zstandard
+    ps.orjson
+  ]);
 
   # Build a small mock package for the test cache.
   mockHello = pkgs.runCommand "mock-hello-1.0" { } ''
@@ -52,8 +56,7 @@ pkgs.runCommand "test-binary-cache"
   (
     {
       nativeBuildInputs = [
-        pkgs.python3
-        pkgs.zstd
+        python
       ];
       # Make packages available in sandbox
       inherit mockHello;
@@ -66,7 +69,9 @@ pkgs.runCommand "test-binary-cache"
     # Copy the mock package to a temp location so the builder can read it
     # (Nix store paths are readable in the sandbox)
 
-    ${pkgs.python3}/bin/python3 ${buildBinaryCachePy} \
+    # Stay within the builder's core allowance (0 means all cores).
+    ${python}/bin/python3 ${buildBinaryCachePy} \
+      -j "''${NIX_BUILD_CORES:-0}" \
       ${packageInfo} \
       "$out"
 
@@ -90,6 +95,6 @@ pkgs.runCommand "test-binary-cache"
 
     echo ""
     echo "Test binary cache built:"
-    echo "  packages: $(${pkgs.python3}/bin/python3 -c "import json; d=json.load(open('$out/packages.json')); print(len(d['packages']))")"
+    echo "  packages: $(${python}/bin/python3 -c "import json; d=json.load(open('$out/packages.json')); print(len(d['packages']))")"
     echo "  size:     $(du -sh "$out" | cut -f1)"
   ''